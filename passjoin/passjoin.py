@@ -1,4 +1,84 @@
+import sys
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy
+
+
+def _compute_partitions(word_length, max_distance):
+    """
+    Computes how to partition a word given the max distance threshold.
+
+    Module-level function so the hot loops pay no bound-method dispatch.
+
+    :param word_length: length of the word to partition
+    :param max_distance: maximum distance threshold
+    :return: numpy.ndarray[int32] of shape (segments, 3), rows holding
+        (partition_index, partition_start_index, partition_length)
+    """
+    segments_number = max_distance + 1
+    small_segments_length = word_length // segments_number
+    large_segments_length = small_segments_length + 1
+
+    large_segments_number = word_length - small_segments_length * segments_number
+    small_segments_number = segments_number - large_segments_number
+
+    small_partitions = [
+        (i, i * small_segments_length, small_segments_length)
+        for i in range(small_segments_number)
+    ]
+
+    offset = small_segments_number * small_segments_length
+
+    large_partitions = [
+        (small_segments_number + j, offset + j * large_segments_length, large_segments_length)
+        for j in range(large_segments_number)
+    ]
+
+    # a contiguous array keeps the per-length partition data in one cache
+    # line and exposes the columns to vectorized arithmetic
+    return numpy.array(
+        small_partitions + large_partitions, dtype=numpy.int32
+    ).reshape(-1, 3)
+
+
+def _start_position_ranges(partitions, length_delta, word_length, max_distance):
+    """
+    Compute the minimum and maximum positions bounding the substring selection
+    process (the multi-match-aware substring selection process defined in the
+    paper) for all partitions of a candidate length at once.
+
+    :param partitions: (segments, 3) int32 array of (index, start, length) rows
+    :param length_delta: difference of length between the reference word and the similar candidates
+    :param word_length: length of the reference word
+    :param max_distance: maximum distance threshold
+    :return: (minimum start positions, maximum start positions) int arrays, one entry per partition
+    """
+    segment_indexes = partitions[:, 0]
+    segment_positions = partitions[:, 1]
+    segment_lengths = partitions[:, 2]
+
+    spreads = max_distance - segment_indexes
+    shifted_positions = segment_positions + length_delta
+
+    min_start_positions = numpy.maximum(
+        numpy.maximum(
+            segment_positions - segment_indexes,  # left-side perspective
+            shifted_positions - spreads,  # right-side perspective
+        ),
+        0,  # lower-bound
+    )
+
+    max_start_positions = numpy.minimum(
+        numpy.minimum(
+            segment_positions + segment_indexes,  # left-side perspective
+            shifted_positions + spreads,  # right-side perspective
+        ),
+        word_length - segment_lengths,  # upper-bound
+    )
+
+    return min_start_positions, max_start_positions
 
 
 class Passjoin(object):
@@ -6,148 +86,185 @@ class Passjoin(object):
     Pass-join index as described in http://people.csail.mit.edu/dongdeng/papers/vldb2012-passjoin.pdf
     This index allows to efficiently query similar words within a distance threshold.
     """
-    def __init__(self, words, max_distance, distance_function):
+    def __init__(self, words, max_distance, distance_function=None, batch_distance_function=None):
         """
         :param words: list (or iterable) of words to index
         :param max_distance: maximum distance for 2 words to be considered as similar
-        :param distance_function: string distance function f(str, str) -> int
+        :param distance_function: string distance function f(str, str) -> int.
+            Defaults to rapidfuzz's Levenshtein distance bounded by
+            max_distance, which stops computing as soon as the threshold is
+            exceeded instead of filling the whole edit matrix.
+        :param batch_distance_function: optional batched string distance function
+            f(str, list[str]) -> iterable of int, returning the distance between
+            the word and every candidate in one call (e.g. a wrapper around
+            rapidfuzz.process.cdist). When provided, candidates are deduplicated
+            and verified in a single call instead of one call per candidate.
         """
+        if distance_function is None:
+            from rapidfuzz.distance import Levenshtein
+
+            # a distance above the cutoff is reported as cutoff + 1, which
+            # still fails the <= max_distance check in get_word_variations
+            distance_function = partial(Levenshtein.distance, score_cutoff=max_distance)
+
         self._max_distance = max_distance
         self._distance_function = distance_function
-        self._inverted_index_by_length = self._build_inverted_index_by_length(words)
-
-    def _build_inverted_index_by_length(self, words):
+        self._batch_distance_function = batch_distance_function
+        self._partitions_by_length = {}
+        # words are interned into integer ids: posting lists become compact
+        # int32 arrays and candidate accumulation a boolean mask over ids
+        self._id_to_word = list(dict.fromkeys(words))
+        self._inverted_index = self._build_inverted_index(self._id_to_word)
+        self._indexed_lengths = numpy.array(
+            sorted({len(word) for word in self._id_to_word}), dtype=numpy.int32)
+
+    def _build_inverted_index(self, words):
         """
-        Builds a bunch of inverted indexes from the given words,
-        one index per word length.
+        Builds a single inverted index from the given words, keyed by
+        the word length along with the segment, so that a probe costs one
+        dict lookup instead of one per level.
 
-        :param words: iterable over words to index
+        :param words: list of distinct words to index, positions giving their ids
 
-        :return: dict[word_length] -> (dict[(word_segment_index, word_segment)] -> word)
+        :return: dict[(word_length, word_segment_index, word_segment)] -> numpy.ndarray[int32] of word ids
+
+        A trie keyed on the segments (e.g. marisa-trie) would share substring
+        prefixes, but segments are short and rarely share prefixes across
+        partitions, and the query path relies on dict key views for its
+        C-level set intersection, so a flat dict is kept on purpose.
         """
-        inverted_index_by_length = defaultdict(lambda: defaultdict(set))
+        inverted_index = defaultdict(list)
 
-        for word in words:
-            length = len(word)
+        # append instead of set.add: a word contributes one segment per
+        # segment index, so a posting list cannot hold duplicate ids
+        for word_id, word in enumerate(words):
             for key in self._generate_segments(word):
-                inverted_index_by_length[length][key].add(word)
+                inverted_index[key].append(word_id)
 
-        return inverted_index_by_length
+        # freeze into a plain dict of contiguous int32 posting lists: the index
+        # is read-only after build, and arrays are smaller than sets of str
+        return {
+            key: numpy.fromiter(word_ids, dtype=numpy.int32, count=len(word_ids))
+            for key, word_ids in inverted_index.items()
+        }
 
     def _candidates_word_length_range(self, word):
         """
         Generates the range of word lengths that we must check
-        to find words similars to the input word.
+        to find words similars to the input word, restricted to the
+        lengths actually present in the index.
 
         :param word: reference word
-        :return: length of word +/- the maximum accepted distance
+        :return: list of indexed word lengths within word length +/- the maximum accepted distance
         """
         word_length = len(word)
-        return range(
-            max(0, word_length - self._max_distance),
-            word_length + self._max_distance + 1
-        )
+        indexed_lengths = self._indexed_lengths
+
+        lower_bound = numpy.searchsorted(
+            indexed_lengths, word_length - self._max_distance)
+        upper_bound = numpy.searchsorted(
+            indexed_lengths, word_length + self._max_distance, side='right')
 
-    def _compute_partitions(self, word_length):
+        return indexed_lengths[lower_bound:upper_bound].tolist()
+
+    def _get_partitions(self, word_length):
         """
-        Computes how to partition a word given the max distance threshold
+        Return the partitions for the given word length, computing and caching
+        them on first use. Partitions only depend on the word length and the
+        max distance threshold, so they are shared by every word of the same
+        length, both at build and at query time.
 
         :param word_length: length of the word to partition
-        :return: list[(partition_index, partition_start_index, partition_length)]
+        :return: numpy.ndarray[int32] of shape (segments, 3), rows holding
+            (partition_index, partition_start_index, partition_length)
         """
-        segments_number = self._max_distance + 1
-        small_segments_length = word_length // segments_number
-        large_segments_length = small_segments_length + 1
-
-        large_segments_number = word_length - small_segments_length * segments_number
-        small_segments_number = segments_number - large_segments_number
-
-        small_partitions = [
-            (i, i * small_segments_length, small_segments_length)
-            for i in range(small_segments_number)
-        ]
-
-        offset = small_segments_number * small_segments_length
-
-        large_partitions = [
-            (small_segments_number + j, offset + j * large_segments_length, large_segments_length)
-            for j in range(large_segments_number)
-        ]
-
-        return small_partitions + large_partitions
+        partitions = self._partitions_by_length.get(word_length)
+        if partitions is None:
+            partitions = self._partitions_by_length[word_length] = _compute_partitions(
+                word_length, self._max_distance)
+        return partitions
 
     def _generate_segments(self, word):
         """
         Partition the given word given the max distance threshold
 
         :param word: word to partition
-        :return: list[word_chunk]
-        """
-        return [
-            (i, word[start:start + length])
-            for i, start, length in self._compute_partitions(len(word))
-        ]
-
-    def _minimum_start_position(self, length_delta, segment_index, segment_position):
+        :return: list[(word_length, segment_index, word_chunk)]
         """
-        Compute the minimum position to start the substring selection process (the 
-        multi-match-aware substring selection process defined in the paper).
+        word_length = len(word)
+        max_distance = self._max_distance
 
-        :param length_delta: difference of length between the reference word and the similar candidates
-        :param segment_index: index of the current segment used to generate substring
-        :param segment_position: position of the current segment used to generate substring
-        :return: minimum position to start the substring selection process
-        """
-        start_left = segment_position - segment_index  # left-side perspective
-        start_right = segment_position + length_delta - (self._max_distance - segment_index)  # right-side perspective
-        start_lower = 0  # lower-bound
-        
-        return max(start_left, start_right, start_lower)
+        # hand-unrolled fast paths for the common thresholds, bypassing the
+        # partition machinery: 0 keeps the whole word, 1 splits it in half
+        if max_distance == 0:
+            return [(word_length, 0, sys.intern(word))]
 
-    def _maximum_start_position(self, length_delta, segment_index, word_length, segment_position, segment_length):
-        """
-        Compute the maximum position to start the substring selection process (the 
-        multi-match-aware substring selection process defined in the paper).
+        if max_distance == 1:
+            half_length = word_length // 2
+            return [
+                (word_length, 0, sys.intern(word[:half_length])),
+                (word_length, 1, sys.intern(word[half_length:])),
+            ]
 
-        :param length_delta: difference of length between the reference word and the similar candidates
-        :param segment_index: index of the current segment used to generate substring
-        :param word_length: length of the reference word
-        :param segment_position: position of the current segment used to generate substring
-        :param segment_length: length of the current segment used to generate substring
-        :return: maximum position to start the substring selection process
-        """
-        end_left = segment_position + segment_index  # left-side perspective
-        end_right = segment_position + length_delta + (self._max_distance - segment_index)  # right-side perspective
-        end_upper = word_length - segment_length  # upper-bound
-        
-        return min(end_left, end_right, end_upper)
+        return [
+            (word_length, i, sys.intern(word[start:start + length]))
+            for i, start, length in self._get_partitions(word_length)
+        ]
 
-    def _substrings_selection(self, word, candidate_length, segment_index, segment_position, segment_length):
+    def _collect_candidates(self, word):
         """
-        Multi-match-aware substring selection process, used to select which key in the inverted index must
-        be considered to check for similar words.
+        Collect the distinct indexed words that may be similar to the given
+        word, running the multi-match-aware substring selection process as a
+        single inlined loop. Candidates matching through several substrings are
+        deduplicated through the id mask before any distance computation.
 
         :param word: reference word
-        :param candidate_length: length of the similar candidates
-        :param segment_index: index of the current segment used to generate substring
-        :param segment_position: position of the current segment used to generate substring
-        :param segment_length: length of the current segment used to generate substring
-        :return: list of substrings generated from the given word
+        :return: list of distinct candidate words
         """
+        inverted_index = self._inverted_index
+        max_distance = self._max_distance
         word_length = len(word)
+        intern = sys.intern
+
+        # with a zero threshold the only candidate length is the word's own
+        # length and the only valid probe is the whole word
+        if max_distance == 0:
+            probe_keys = {(word_length, 0, intern(word))}
+        else:
+            probe_keys = set()
+            add_probe_key = probe_keys.add
+
+            for candidate_length in self._candidates_word_length_range(word):
+                length_delta = word_length - candidate_length
+                partitions = self._get_partitions(candidate_length)
+
+                min_start_positions, max_start_positions = _start_position_ranges(
+                    partitions, length_delta, word_length, max_distance)
+
+                for segment_index, segment_length, min_start_position, max_start_position in zip(
+                    partitions[:, 0].tolist(),
+                    partitions[:, 2].tolist(),
+                    min_start_positions.tolist(),
+                    max_start_positions.tolist(),
+                ):
+                    # the selection range can be empty for extreme length
+                    # deltas, e.g. when only the endpoint segments can match
+                    for position in range(min_start_position, max_start_position + 1):
+                        add_probe_key((
+                            candidate_length,
+                            segment_index,
+                            intern(word[position : (position + segment_length)]),
+                        ))
 
-        length_delta = word_length - candidate_length
-
-        min_start_position = self._minimum_start_position(
-            length_delta, segment_index, segment_position)
+        candidate_mask = numpy.zeros(len(self._id_to_word), dtype=bool)
 
-        max_start_position = self._maximum_start_position(
-            length_delta, segment_index, word_length, segment_position, segment_length)
+        # dict views support set algebra, so the intersection runs in C over
+        # the smaller operand instead of one Python-level lookup per probe
+        for key in probe_keys & inverted_index.keys():
+            candidate_mask[inverted_index[key]] = True
 
-        return [
-            word[ position : (position + segment_length) ]  
-            for position in range(min_start_position, max_start_position + 1)
-        ]
+        id_to_word = self._id_to_word
+        return [id_to_word[word_id] for word_id in numpy.flatnonzero(candidate_mask)]
 
     def get_word_variations(self, word):
         """
@@ -158,22 +275,43 @@ class Passjoin(object):
         :param word: reference word
         :return: set(similar_words)
         """
-        variations = set()
-        distance = self._distance_function
         max_distance = self._max_distance
+        candidates = self._collect_candidates(word)
+
+        if not candidates:
+            return set()
+
+        if self._batch_distance_function is not None:
+            distances = self._batch_distance_function(word, candidates)
+            if not isinstance(distances, numpy.ndarray):
+                # materialize plain iterables (e.g. generators), which asarray
+                # would otherwise wrap into a useless 0-d object array
+                distances = numpy.asarray(list(distances))
+            # ravel also accepts the (1, n) matrix shape returned by
+            # rapidfuzz.process.cdist; the threshold comparison then runs
+            # on the whole distance vector at once
+            return {
+                candidates[candidate_index]
+                for candidate_index in numpy.flatnonzero(distances.ravel() <= max_distance)
+            }
 
-        for candidate_length in self._candidates_word_length_range(word):
-            inverted_index = self._inverted_index_by_length.get(candidate_length)
-
-            if inverted_index is None:
-                continue
+        distance = self._distance_function
+        return {
+            candidate
+            for candidate in candidates
+            if distance(word, candidate) <= max_distance
+        }
 
-            for partition_index, partition_start, partition_length in self._compute_partitions(candidate_length):
-                for substring in self._substrings_selection(
-                    word, candidate_length, partition_index, partition_start, partition_length
-                ):
-                    candidates = inverted_index.get((partition_index, substring), [])
-                    for candidate in candidates:
-                        if distance(word, candidate) <= max_distance:
-                            variations.add(candidate)
-        return variations
+    def get_word_variations_batch(self, words, workers=None):
+        """
+        Return the variations of several words, querying the index from a
+        thread pool. The index itself is read-only so queries are thread-safe,
+        and C distance functions that release the GIL (e.g. Levenshtein)
+        let the verification step run in parallel.
+
+        :param words: iterable of reference words
+        :param workers: number of threads to use, defaults to the executor's own default
+        :return: list of set(similar_words), in the order of the input words
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.get_word_variations, words))
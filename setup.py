@@ -14,6 +14,7 @@ setup(
     maintainer_email='romain.senesi@mapado.com',
     url='https://github.com/mapado/passjoin',
     packages=['passjoin'],
+    install_requires=['numpy', 'rapidfuzz'],
     license=['MIT'],
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -35,6 +35,39 @@ class TestPassjoin(unittest.TestCase):
         self.assertSetEqual(passjoin_index.get_word_variations('irafr'), {'girafe'})
         self.assertSetEqual(passjoin_index.get_word_variations('giirofr'), set())
 
+    def test_batch_distance_function(self):
+        """"""
+        def batch_distance(word, candidates):
+            return [distance(word, candidate) for candidate in candidates]
+
+        passjoin_index = Passjoin(
+            ['girafe', 'lion', 'tiger'], 1, distance,
+            batch_distance_function=batch_distance)
+        self.assertSetEqual(passjoin_index.get_word_variations('giraf'), {'girafe'})
+        self.assertSetEqual(passjoin_index.get_word_variations('grfe'), set())
+
+        def lazy_batch_distance(word, candidates):
+            return (distance(word, candidate) for candidate in candidates)
+
+        passjoin_index = Passjoin(
+            ['girafe', 'lion', 'tiger'], 1, distance,
+            batch_distance_function=lazy_batch_distance)
+        self.assertSetEqual(passjoin_index.get_word_variations('giraf'), {'girafe'})
+        self.assertSetEqual(passjoin_index.get_word_variations('grfe'), set())
+
+    def test_default_distance_function(self):
+        """"""
+        passjoin_index = Passjoin(['girafe', 'lion', 'tiger'], 1)
+        self.assertSetEqual(passjoin_index.get_word_variations('giraf'), {'girafe'})
+        self.assertSetEqual(passjoin_index.get_word_variations('grfe'), set())
+
+    def test_batch_queries(self):
+        """"""
+        passjoin_index = Passjoin(['girafe', 'lion', 'tiger'], 1, distance)
+        self.assertListEqual(
+            passjoin_index.get_word_variations_batch(['giraf', 'lions', 'grfe']),
+            [{'girafe'}, {'lion'}, set()])
+
     def test_special_cases(self):
         """"""
         passjoin_index = Passjoin(['girafe', 'lion', 'tiger'], 0, distance)